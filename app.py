@@ -1,10 +1,21 @@
 import streamlit as st
+import asyncio
 import os
-import json
 import io
+import orjson
+import random
+import shelve
+import threading
+import time
+from concurrent.futures import Future
+from hashlib import blake2b
+from pathlib import Path
+from typing import NamedTuple
 from dotenv import load_dotenv
 from google import genai
+from google.genai import errors, types
 from PIL import Image
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
 # Page Config
 st.set_page_config(
@@ -16,10 +27,314 @@ st.set_page_config(
 # Load Environment Variables
 load_dotenv()
 
-def get_gemini_client(api_key):
-    return genai.Client(api_key=api_key)
+def _session_id():
+    return get_script_run_ctx().session_id
 
-def analyze_image(client, image, example_structure):
+@st.cache_resource
+def _session_loop(session_id):
+    # One long-lived event loop per session, on a daemon thread. asyncio.run
+    # per click would close its loop on exit, stranding the async client's
+    # keep-alive connections under a dead loop; the next click's loop then
+    # picks them up and httpx raises RuntimeError.
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(
+        target=loop.run_forever, daemon=True, name=f"remake-loop-{session_id}"
+    )
+    thread.start()
+    return loop, thread
+
+def run_async(coro):
+    # Run a pipeline on this session's loop, blocking the script thread for
+    # the result. The loop thread needs the session's script-run context for
+    # the st.* calls the pipelines make (status writes, placeholders,
+    # session_state); re-attach it each call since the context changes
+    # between runs.
+    ctx = get_script_run_ctx()
+    loop, thread = _session_loop(ctx.session_id)
+    add_script_run_ctx(thread, ctx)
+    return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+async def _warm_connection(client):
+    # A throwaway models.list pays the TLS + HTTP/2 handshake up front so
+    # the first real call rides an already-warm pooled connection. All real
+    # calls go through client.aio, which keeps its own httpx client separate
+    # from the sync one, so that's the transport to warm.
+    try:
+        await client.aio.models.list(config={'page_size': 1})
+    except Exception:
+        pass
+
+@st.cache_resource
+def get_gemini_client(api_key, session_id):
+    # Cached per session as well as key: the aio transport's pooled
+    # connections belong to the session's event loop and must never be
+    # shared across loops.
+    client = genai.Client(api_key=api_key)
+    # Fire-and-forget on the same loop the pipelines will use.
+    loop, _ = _session_loop(session_id)
+    asyncio.run_coroutine_threadsafe(_warm_connection(client), loop)
+    return client
+
+def _text_model():
+    # Economy mode trades some analysis/refinement quality for roughly half
+    # the token cost; image generation always stays on the standard model
+    # since the user is actively watching it.
+    if st.session_state.get("economy_mode"):
+        return 'gemini-2.5-flash-lite'
+    return 'gemini-2.5-flash'
+
+# On-disk cache shared across sessions; shelve is not thread-safe so all
+# access goes through the lock.
+_CACHE_PATH = ".remake_cache"
+
+@st.cache_resource
+def _shelve_lock():
+    # Streamlit re-execs this module on every rerun, so a module-level lock
+    # would be a fresh object per run and serialize nothing; cache_resource
+    # is the one store shared across reruns and sessions.
+    return threading.Lock()
+
+def _img_digest(img):
+    return blake2b(img.tobytes(), digest_size=16).hexdigest()
+
+def _prep(img):
+    # Vision analysis gains nothing from >1024px; downscaling plus JPEG
+    # re-encoding cuts upload bytes and vision tokens by an order of
+    # magnitude on phone photos.
+    img = img.copy()
+    img.thumbnail((1024, 1024), Image.LANCZOS)
+    if img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=85)
+    return buf.getvalue()
+
+def _image_part(image_bytes):
+    return types.Part.from_bytes(data=image_bytes, mime_type="image/jpeg")
+
+def _compact_json(obj):
+    # Prompt payloads sent to the model: indentation is billed whitespace
+    # that carries no meaning, so keep pretty-printing for the UI only.
+    # orjson is compact by default and its C encoder is 2-5x faster than
+    # stdlib json on the nested dicts these prompts grow into.
+    return orjson.dumps(obj).decode()
+
+# Memoized per image content and format, so a rerun or a format flip
+# never re-encodes the same pixels twice. st.cache_data is shared across
+# sessions, so the key must be a content digest: id() of a freed image
+# can be recycled and would serve another image's bytes. WebP is the
+# default: libwebp encodes 2-4x faster than PNG deflate and produces
+# 30-50% smaller files at this quality.
+@st.cache_data(hash_funcs={Image.Image: _img_digest})
+def _encode_image(img, fmt):
+    buf = io.BytesIO()
+    if fmt == "WEBP":
+        img.save(buf, format="WEBP", quality=92, method=4)
+    else:
+        img.save(buf, format="PNG")
+    return buf.getvalue()
+
+def _download_format():
+    if st.session_state.get("download_format") == "PNG":
+        return "PNG", "png", "image/png"
+    return "WEBP", "webp", "image/webp"
+
+class Refinement(NamedTuple):
+    image: Image.Image
+    prompt: dict
+    changes: list
+
+def _prompt_key(prompt):
+    return blake2b(
+        orjson.dumps(prompt, option=orjson.OPT_SORT_KEYS), digest_size=16
+    ).hexdigest()
+
+# Content-keyed for the same reason as _encode_image: the cache outlives
+# any one image object, so object identity is not a safe key.
+@st.cache_data(hash_funcs={Image.Image: _img_digest})
+def _thumbnail(img):
+    t = img.copy()
+    t.thumbnail((256, 256))
+    buf = io.BytesIO()
+    # WEBP: 3-5x smaller than PNG at the same perceptual quality, so the
+    # history strip re-transmits far fewer bytes per rerun.
+    t.save(buf, format="WEBP", quality=80)
+    return buf.getvalue()
+
+def _cache_get(key):
+    cached = st.session_state.analysis_cache.get(key)
+    if cached is not None:
+        return cached
+    with _shelve_lock():
+        with shelve.open(_CACHE_PATH) as db:
+            cached = db.get(key)
+    if cached is not None:
+        st.session_state.analysis_cache[key] = cached
+    return cached
+
+def _cache_put(key, value):
+    st.session_state.analysis_cache[key] = value
+    with _shelve_lock():
+        with shelve.open(_CACHE_PATH) as db:
+            db[key] = value
+
+class TokenBucket:
+    # Process-wide limiter sized to the Gemini RPM/TPM caps. Blocking the
+    # caller briefly beats firing the request and eating a 429.
+    def __init__(self, rpm=15, tpm=1_000_000):
+        self._lock = threading.Lock()
+        self._rpm = rpm
+        self._tpm = tpm
+        self._requests = float(rpm)
+        self._tokens = float(tpm)
+        self._last = time.monotonic()
+
+    def configure(self, rpm, tpm):
+        with self._lock:
+            self._rpm = rpm
+            self._tpm = tpm
+            self._requests = min(self._requests, float(rpm))
+            self._tokens = min(self._tokens, float(tpm))
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._last
+        self._last = now
+        self._requests = min(float(self._rpm), self._requests + elapsed * self._rpm / 60.0)
+        self._tokens = min(float(self._tpm), self._tokens + elapsed * self._tpm / 60.0)
+
+    def acquire(self, tokens=1):
+        # Blocks the calling thread; async callers wrap in asyncio.to_thread.
+        while True:
+            with self._lock:
+                self._refill()
+                # An estimate larger than the whole budget could never be
+                # satisfied; clamp so it degrades to "wait for a full bucket"
+                # instead of spinning forever. Re-read each pass in case the
+                # sidebar reconfigures the limits mid-wait.
+                need = min(float(tokens), float(self._tpm))
+                if self._requests >= 1.0 and self._tokens >= need:
+                    self._requests -= 1.0
+                    self._tokens -= need
+                    return
+                wait = max(
+                    (1.0 - self._requests) * 60.0 / self._rpm,
+                    (need - self._tokens) * 60.0 / self._tpm,
+                )
+            time.sleep(min(wait, 1.0))
+
+@st.cache_resource
+def _token_bucket():
+    # One bucket for the whole process: a module-level instance would be
+    # rebuilt full on every rerun, so rapid clicks would never be throttled
+    # across reruns, which is the case the limiter exists for.
+    return TokenBucket()
+
+# Rough per-image vision token cost; estimates only need to be in the
+# right ballpark for throttling.
+_IMAGE_TOKEN_ESTIMATE = 258
+
+def _estimate_tokens(text, images=0):
+    return len(text) // 4 + images * _IMAGE_TOKEN_ESTIMATE
+
+# Rate limits (429) and transient server errors are worth retrying;
+# anything else should surface immediately.
+_RETRYABLE_CODES = {429, 500, 502, 503, 504}
+_MAX_ATTEMPTS = 3
+
+def _retry_after_seconds(e):
+    try:
+        return float(e.response.headers["Retry-After"])
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return None
+
+async def _with_retries(attempt):
+    for tries in range(_MAX_ATTEMPTS):
+        try:
+            return await attempt()
+        except errors.APIError as e:
+            if e.code not in _RETRYABLE_CODES or tries == _MAX_ATTEMPTS - 1:
+                raise
+            delay = _retry_after_seconds(e)
+            if delay is None:
+                delay = (2 ** tries) + random.random()
+            await asyncio.sleep(delay)
+
+# Single-flight coalescing: concurrent calls with the same key (double
+# clicks, parallel sessions) share one in-flight request instead of each
+# paying for its own API call.
+@st.cache_resource
+def _inflight_registry():
+    # Module globals are rebuilt on every script exec, which would leave
+    # each rerun/session with its own empty map and nothing to coalesce
+    # against; the registry has to live in cache_resource to be shared.
+    return {}, threading.Lock()
+
+async def _single_flight(key, attempt):
+    inflight, lock = _inflight_registry()
+    with lock:
+        fut = inflight.get(key)
+        if fut is None:
+            fut = Future()
+            inflight[key] = fut
+            leader = True
+        else:
+            leader = False
+
+    if not leader:
+        # Future.result blocks, so wait for the leader off the event loop.
+        return await asyncio.to_thread(fut.result)
+
+    try:
+        result = await attempt()
+        fut.set_result(result)
+        return result
+    except BaseException as e:
+        fut.set_exception(e)
+        raise
+    finally:
+        with lock:
+            inflight.pop(key, None)
+
+@st.cache_data
+def load_example_structure():
+    try:
+        return Path("prompt_example.txt").read_text()
+    except FileNotFoundError:
+        return "Provide a detailed JSON description of the image."
+
+# How many refinement prompts to request per comparison call. One
+# comparison amortizes over several candidates, so cost-per-accepted
+# refinement drops versus click-iterating.
+_REFINE_CANDIDATES = 4
+
+async def _stream_candidates(client, model, contents, config=None, placeholder=None):
+    # Accumulate streamed text per candidate, echoing the first candidate's
+    # progress into the caller's placeholder so the user sees output at
+    # first-token time. Returns one string per candidate.
+    buffers = {}
+    stream = await client.aio.models.generate_content_stream(
+        model=model,
+        contents=contents,
+        config=config or {'response_mime_type': 'application/json'},
+    )
+    async for chunk in stream:
+        for cand in (chunk.candidates or []):
+            if not (cand.content and cand.content.parts):
+                continue
+            idx = cand.index or 0
+            for part in cand.content.parts:
+                if part.text:
+                    buffers[idx] = buffers.get(idx, "") + part.text
+        if placeholder is not None and 0 in buffers:
+            placeholder.code(buffers[0], language="json")
+    return [buffers[i] for i in sorted(buffers)]
+
+async def _stream_text(client, model, contents, config=None, placeholder=None):
+    texts = await _stream_candidates(client, model, contents, config, placeholder)
+    return texts[0] if texts else ""
+
+async def analyze_image(client, image_bytes, example_structure, placeholder=None):
     prompt = f"""
     Analyze this image and provide a detailed, structured JSON description.
     The output MUST be valid JSON.
@@ -27,19 +342,33 @@ def analyze_image(client, image, example_structure):
     
     {example_structure}
     """
-    
-    try:
-        response = client.models.generate_content(
-            model='gemini-2.5-flash',
-            contents=[prompt, image],
-            config={'response_mime_type': 'application/json'}
+
+    key = "analyze:" + blake2b(
+        _text_model().encode() + image_bytes + example_structure.encode(), digest_size=16
+    ).hexdigest()
+    cached = _cache_get(key)
+    if cached is not None:
+        return cached
+
+    async def _attempt():
+        await asyncio.to_thread(_token_bucket().acquire, _estimate_tokens(prompt, images=1))
+        text = await _stream_text(
+            client,
+            model=_text_model(),
+            contents=[prompt, _image_part(image_bytes)],
+            placeholder=placeholder,
         )
-        return json.loads(response.text)
+        result = orjson.loads(text)
+        _cache_put(key, result)
+        return result
+
+    try:
+        return await _single_flight(key, lambda: _with_retries(_attempt))
     except Exception as e:
         st.error(f"Error analyzing image: {e}")
         return None
 
-def refine_prompt(client, source_img, generated_img, current_prompt_json):
+async def refine_prompt(client, source_bytes, generated_bytes, current_prompt_json, placeholder=None):
     comparison_prompt = f"""
     You are an expert image generation prompt engineer.
     
@@ -47,7 +376,7 @@ def refine_prompt(client, source_img, generated_img, current_prompt_json):
     Image 2 is the GENERATED image (current attempt).
     
     The generated image was created using this JSON prompt:
-    {json.dumps(current_prompt_json, indent=2)}
+    {_compact_json(current_prompt_json)}
     
     Compare the two images. Identify key differences where the generated image fails to capture the source image's details.
     
@@ -65,41 +394,139 @@ def refine_prompt(client, source_img, generated_img, current_prompt_json):
         "new_prompt": {{ ... the full updated JSON prompt ... }}
     }}
     """
-    
-    try:
-        response = client.models.generate_content(
-            model='gemini-2.5-flash',
-            contents=[comparison_prompt, source_img, generated_img],
-            config={'response_mime_type': 'application/json'}
+
+    key = "refine:" + blake2b(
+        _text_model().encode() + source_bytes + generated_bytes
+        + orjson.dumps(current_prompt_json, option=orjson.OPT_SORT_KEYS),
+        digest_size=16,
+    ).hexdigest()
+    cached = _cache_get(key)
+    if cached is not None:
+        return cached
+
+    async def _attempt():
+        await asyncio.to_thread(
+            _token_bucket().acquire, _estimate_tokens(comparison_prompt, images=2)
         )
-        return json.loads(response.text)
+        texts = await _stream_candidates(
+            client,
+            model=_text_model(),
+            contents=[comparison_prompt, _image_part(source_bytes), _image_part(generated_bytes)],
+            config={
+                'candidate_count': _REFINE_CANDIDATES,
+                'response_mime_type': 'application/json',
+            },
+            placeholder=placeholder,
+        )
+        results = []
+        for text in texts:
+            try:
+                parsed = orjson.loads(text)
+            except orjson.JSONDecodeError:
+                continue
+            if parsed.get("new_prompt"):
+                results.append(parsed)
+        if not results:
+            raise ValueError("no parseable refinement candidates in response")
+        _cache_put(key, results)
+        return results
+
+    try:
+        return await _single_flight(key, lambda: _with_retries(_attempt))
     except Exception as e:
         st.error(f"Error refining prompt: {e}")
         return None
 
-def generate_image_from_prompt(client, prompt_json, input_image=None):
-    prompt_text = "Generate a photorealistic image based on this detailed description:\n\n" + json.dumps(prompt_json, indent=2)
+async def generate_image_from_prompt(client, prompt_json, input_image=None, placeholder=None):
+    prompt_text = "Generate a photorealistic image based on this detailed description:\n\n" + _compact_json(prompt_json)
     
     contents = [prompt_text]
     if input_image:
         contents.append(input_image)
 
-    try:
-        response = client.models.generate_content(
+    key = "generate:" + blake2b(
+        prompt_text.encode()
+        + (_img_digest(input_image).encode() if input_image else b""),
+        digest_size=16,
+    ).hexdigest()
+
+    async def _attempt():
+        await asyncio.to_thread(
+            _token_bucket().acquire,
+            _estimate_tokens(prompt_text, images=1 if input_image else 0),
+        )
+        buf = bytearray()
+        stream = await client.aio.models.generate_content_stream(
             model='gemini-2.5-flash-image',
             contents=contents
         )
-        
-        if response.candidates and response.candidates[0].content.parts:
-            for part in response.candidates[0].content.parts:
-                if part.inline_data:
-                    image_bytes = part.inline_data.data
-                    return Image.open(io.BytesIO(image_bytes))
+        async for chunk in stream:
+            if not (chunk.candidates and chunk.candidates[0].content
+                    and chunk.candidates[0].content.parts):
+                continue
+            for part in chunk.candidates[0].content.parts:
+                if part.inline_data and part.inline_data.data:
+                    buf.extend(part.inline_data.data)
+                    if placeholder is not None:
+                        # Partial buffers may not decode yet; show what we can.
+                        try:
+                            placeholder.image(Image.open(io.BytesIO(bytes(buf))))
+                        except Exception:
+                            pass
+
+        if buf:
+            return Image.open(io.BytesIO(bytes(buf)))
         return None
+
+    try:
+        return await _single_flight(key, lambda: _with_retries(_attempt))
     except Exception as e:
         st.error(f"Error generating image: {e}")
         return None
 
+async def run_remake_pipeline(client, image_bytes):
+    example_structure = load_example_structure()
+
+    st.write("Extracting details with Gemini 2.5 Flash...")
+    placeholder = st.empty()
+    prompt_json = await analyze_image(client, image_bytes, example_structure, placeholder=placeholder)
+    if not prompt_json:
+        return None, None
+    placeholder.empty()
+
+    st.write("Prompt generated!")
+    st.write("Generating new image with Gemini 2.5 Flash Image (Nano Banana)...")
+    generated_image = await generate_image_from_prompt(
+        client, prompt_json, placeholder=st.empty()
+    )
+    return prompt_json, generated_image
+
+async def run_refine_pipeline(client, source_bytes, current_gen_img, current_prompt):
+    st.write("Comparing images and updating prompt...")
+    generated_bytes = await asyncio.to_thread(_prep, current_gen_img)
+    placeholder = st.empty()
+    refinements = await refine_prompt(
+        client, source_bytes, generated_bytes, current_prompt, placeholder=placeholder
+    )
+    if not refinements:
+        return None
+    placeholder.empty()
+
+    st.write(f"Generating {len(refinements)} candidate images...")
+    # Generate from the new prompts (Text-to-Image), not using the previous
+    # image as input; the candidates are independent so they run in parallel.
+    cols = st.columns(len(refinements))
+    placeholders = [col.empty() for col in cols]
+    images = await asyncio.gather(*[
+        generate_image_from_prompt(client, r.get("new_prompt"), placeholder=ph)
+        for r, ph in zip(refinements, placeholders)
+    ])
+    return [
+        (img, r.get("new_prompt"), r.get("changes", []))
+        for r, img in zip(refinements, images)
+        if img
+    ]
+
 # Sidebar
 with st.sidebar:
     st.title("Configuration")
@@ -113,6 +540,21 @@ with st.sidebar:
         help="Get your key from Google AI Studio"
     )
     
+    st.checkbox(
+        "Economy mode (slower, -50% cost)",
+        key="economy_mode",
+        help="Runs analysis and refinement on gemini-2.5-flash-lite. "
+             "Image generation always uses the standard model."
+    )
+
+    st.radio("Download format", ["WebP", "PNG"], key="download_format",
+             help="WebP encodes faster and downloads smaller; pick PNG for lossless.")
+
+    with st.expander("Rate limits"):
+        rpm = st.number_input("Requests per minute", min_value=1, value=15)
+        tpm = st.number_input("Tokens per minute", min_value=1000, value=1_000_000)
+        _token_bucket().configure(rpm, tpm)
+
     st.info("Models used:\n- Analysis: `gemini-2.5-flash`\n- Generation: `gemini-2.5-flash-image`")
 
 # Main Interface
@@ -125,50 +567,60 @@ if 'generated_image' not in st.session_state:
 if 'current_prompt' not in st.session_state:
     st.session_state.current_prompt = None
 if 'refined_images' not in st.session_state:
-    st.session_state.refined_images = [] # List of (image, prompt, changes)
+    st.session_state.refined_images = {} # prompt hash -> Refinement, insertion-ordered
+if 'analysis_cache' not in st.session_state:
+    st.session_state.analysis_cache = {}
+if 'refine_candidates' not in st.session_state:
+    st.session_state.refine_candidates = []
+
+def _keep_candidate(i):
+    img, prompt, changes = st.session_state.refine_candidates[i]
+    st.session_state.refined_images[_prompt_key(prompt)] = Refinement(img, prompt, changes)
+    st.session_state.refine_candidates = []
 
 uploaded_file = st.file_uploader("Choose an image...", type=["jpg", "jpeg", "png"])
 
 if uploaded_file is not None:
-    # Display Original
-    image = Image.open(uploaded_file)
-    
+    # Decode and downscale once per distinct upload, keyed by content hash;
+    # reruns from widget interactions reuse the fully-loaded image instead
+    # of re-parsing the file. Gemini calls use the prepped bytes, not the
+    # full-resolution original.
+    raw = uploaded_file.getvalue()
+    upload_digest = blake2b(raw, digest_size=16).hexdigest()
+    if st.session_state.get("source_digest") != upload_digest:
+        source = Image.open(io.BytesIO(raw))
+        source.load()
+        st.session_state.source_image = source
+        st.session_state.source_digest = upload_digest
+        st.session_state.prepped_image = _prep(source)
+    image = st.session_state.source_image
+
+    # One client per rerun; the Remake and Refine handlers share it.
+    client = get_gemini_client(api_key, _session_id()) if api_key else None
+
     col1, col2 = st.columns(2)
-    
+
     with col1:
         st.subheader("Original Image")
         st.image(image, width="stretch")
 
     # Remake Button
     if st.button("✨ Remake Image", type="primary"):
-        if not api_key:
+        if client is None:
             st.error("Please provide a Gemini API Key in the sidebar.")
         else:
-            client = get_gemini_client(api_key)
-            
-            # Load example structure
-            try:
-                with open("prompt_example.txt", "r") as f:
-                    example_structure = f.read()
-            except FileNotFoundError:
-                example_structure = "Provide a detailed JSON description of the image."
-
-            # Step 1: Analyze
             with st.status("Analyzing image...", expanded=True) as status:
-                st.write("Extracting details with Gemini 2.5 Flash...")
-                prompt_json = analyze_image(client, image, example_structure)
-                
+                prompt_json, generated_image = run_async(
+                    run_remake_pipeline(client, st.session_state.prepped_image)
+                )
+
                 if prompt_json:
                     st.session_state.current_prompt = prompt_json
-                    st.write("Prompt generated!")
-                    
-                    # Step 2: Generate
-                    st.write("Generating new image with Gemini 2.5 Flash Image (Nano Banana)...")
-                    generated_image = generate_image_from_prompt(client, prompt_json)
-                    
+
                     if generated_image:
                         st.session_state.generated_image = generated_image
-                        st.session_state.refined_images = [] # Reset refinements
+                        st.session_state.refined_images = {} # Reset refinements
+                        st.session_state.refine_candidates = []
                         status.update(label="Remake Complete!", state="complete", expanded=False)
                     else:
                         status.update(label="Generation Failed", state="error")
@@ -183,17 +635,13 @@ if uploaded_file is not None:
             
             with st.expander("View Prompt"):
                 st.json(st.session_state.current_prompt)
-            
-            # Download Button
-            buf = io.BytesIO()
-            st.session_state.generated_image.save(buf, format="PNG")
-            byte_im = buf.getvalue()
-            
+
+            fmt, ext, mime = _download_format()
             st.download_button(
                 label="Download Image",
-                data=byte_im,
-                file_name="remade_image.png",
-                mime="image/png"
+                data=_encode_image(st.session_state.generated_image, fmt),
+                file_name=f"remade_image.{ext}",
+                mime=mime
             )
 
         # Refinement Section
@@ -201,61 +649,90 @@ if uploaded_file is not None:
         st.subheader("Refine Result")
         
         if st.button("🔧 Refine Image"):
-            if not api_key:
+            if client is None:
                 st.error("Please provide a Gemini API Key.")
             else:
-                client = get_gemini_client(api_key)
-                
                 # Determine which image to compare against (last refined or initial generated)
-                current_gen_img = st.session_state.refined_images[-1][0] if st.session_state.refined_images else st.session_state.generated_image
-                current_prompt = st.session_state.refined_images[-1][1] if st.session_state.refined_images else st.session_state.current_prompt
+                if st.session_state.refined_images:
+                    last = next(reversed(st.session_state.refined_images.values()))
+                    current_gen_img = last.image
+                    current_prompt = last.prompt
+                else:
+                    current_gen_img = st.session_state.generated_image
+                    current_prompt = st.session_state.current_prompt
 
                 with st.status("Refining image...", expanded=True) as status:
-                    st.write("Comparing images and updating prompt...")
-                    refinement_result = refine_prompt(client, image, current_gen_img, current_prompt)
-                    
-                    if refinement_result:
-                        new_prompt = refinement_result.get("new_prompt")
-                        changes = refinement_result.get("changes", [])
-                        
-                        st.write("Generating refined image...")
-                        # Generate from the new prompt (Text-to-Image), not using the previous image as input
-                        new_image = generate_image_from_prompt(client, new_prompt)
-                        
-                        if new_image:
-                            st.session_state.refined_images.append((new_image, new_prompt, changes))
-                            status.update(label="Refinement Complete!", state="complete", expanded=False)
-                        else:
-                            status.update(label="Generation Failed", state="error")
-                    else:
+                    candidates = run_async(
+                        run_refine_pipeline(
+                            client, st.session_state.prepped_image, current_gen_img, current_prompt
+                        )
+                    )
+
+                    if candidates:
+                        st.session_state.refine_candidates = candidates
+                        status.update(
+                            label="Refinement Complete! Pick a candidate below.",
+                            state="complete", expanded=False
+                        )
+                    elif candidates is None:
                         status.update(label="Refinement Failed", state="error")
+                    else:
+                        status.update(label="Generation Failed", state="error")
+
+        # Candidate Selection
+        if st.session_state.refine_candidates:
+            st.markdown("### Pick a Refinement")
+            c_cols = st.columns(len(st.session_state.refine_candidates))
+            for i, (c_img, c_prompt, c_changes) in enumerate(st.session_state.refine_candidates):
+                with c_cols[i]:
+                    st.image(c_img, width="stretch")
+                    with st.expander("Changes"):
+                        for change in c_changes:
+                            st.markdown(f"- {change}")
+                    st.button(
+                        "Keep this one",
+                        key=f"keep_{i}",
+                        on_click=_keep_candidate,
+                        args=(i,),
+                    )
 
         # Display Refined Images
         if st.session_state.refined_images:
             st.markdown("### Refinement History")
-            for i, (ref_img, ref_prompt, changes) in enumerate(reversed(st.session_state.refined_images)):
-                with st.container():
-                    st.markdown(f"**Refinement {len(st.session_state.refined_images) - i}**")
-                    r_col1, r_col2 = st.columns([1, 2])
-                    
-                    with r_col1:
-                        st.image(ref_img, width="stretch") # Fixed warning
-                        # Download for refined
-                        r_buf = io.BytesIO()
-                        ref_img.save(r_buf, format="PNG")
-                        r_byte_im = r_buf.getvalue()
-                        st.download_button(
-                            label=f"Download Refinement {len(st.session_state.refined_images) - i}",
-                            data=r_byte_im,
-                            file_name=f"refined_image_{len(st.session_state.refined_images) - i}.png",
-                            mime="image/png",
-                            key=f"dl_{i}"
-                        )
-                    
-                    with r_col2:
-                        st.markdown("**Changes Made:**")
-                        for change in changes:
-                            st.markdown(f"- {change}")
-                        with st.expander("View Updated Prompt"):
-                            st.json(ref_prompt)
-                    st.divider()
+            # Render the history as cheap thumbnails plus one selected entry
+            # in full detail, so rerun cost stays O(1) as the session grows.
+            records = list(st.session_state.refined_images.items())
+            labels = {rid: f"Refinement {i + 1}" for i, (rid, _) in enumerate(records)}
+
+            thumb_cols = st.columns(min(len(records), 8))
+            for i, (rid, rec) in enumerate(records):
+                with thumb_cols[i % len(thumb_cols)]:
+                    st.image(_thumbnail(rec.image), caption=f"{i + 1}")
+
+            selected = st.selectbox(
+                "Inspect refinement",
+                options=list(labels),
+                format_func=labels.get,
+                index=len(records) - 1,
+                key="selected_refinement_id",
+            )
+            rec = st.session_state.refined_images[selected]
+
+            r_col1, r_col2 = st.columns([1, 2])
+            with r_col1:
+                st.image(rec.image, width="stretch")
+                fmt, ext, mime = _download_format()
+                st.download_button(
+                    label=f"Download {labels[selected]}",
+                    data=_encode_image(rec.image, fmt),
+                    file_name=f"refined_image_{labels[selected].split()[-1]}.{ext}",
+                    mime=mime,
+                    key="dl_selected",
+                )
+
+            with r_col2:
+                st.markdown("**Changes Made:**")
+                for change in rec.changes:
+                    st.markdown(f"- {change}")
+                with st.expander("View Updated Prompt"):
+                    st.json(rec.prompt)